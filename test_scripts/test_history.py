@@ -1,31 +1,23 @@
-import socket
+import select
 import time
 
-SERVER_IP = "127.0.0.1"
-SERVER_PORT = 12000
+from test_util import make_client, send
+from udp_batch import recv_batch
 
-# Create and return a UDP client socket
-def make_client():
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    sock.bind(("", 0))
-    sock.settimeout(0.1)
-    return sock
+# The server spawns one thread per datagram, so back-to-back say$ commands
+# can reach history_add() in any order; spacing them keeps the order exact
+SEND_GAP = 0.02
 
-# Send a message to the server
-def send(sock, msg):
-    sock.sendto(msg.encode(), (SERVER_IP, SERVER_PORT))
-
-# Collect all packets that arrive within a short time window
-def recv_all(sock, max_wait=1.0):
+# Collect a burst of packets: wait up to max_wait for the first one, then
+# keep draining until the socket stays quiet for `gap` seconds (or the
+# burst hits `limit` packets). Packets are returned as raw (stripped) bytes.
+def recv_all(sock, max_wait=1.0, gap=0.1, limit=64):
     results = []
-    end = time.time() + max_wait
-    while time.time() < end:
-        try:
-            data, _ = sock.recvfrom(4096)
-            text = data.rstrip(b"\x00").decode(errors="replace").strip()
-            results.append(text)
-        except socket.timeout:
-            pass
+    wait = max_wait
+    while len(results) < limit and select.select([sock], [], [], wait)[0]:
+        for data in recv_batch(sock):
+            results.append(data.rstrip(b"\x00").strip())
+        wait = gap
     return results
 
 def main():
@@ -36,16 +28,20 @@ def main():
     # First client connects and generates chat history
     A = make_client()
     send(A, "conn$ HistoryMaker")
-    time.sleep(0.5)
     recv_all(A)
 
     print("\nGenerating 20 broadcast messages...\n")
     
-    # Send 20 broadcast messages to populate history buffer
-    for i in range(20):
-        send(A, f"say$ Message_{i}")
-        time.sleep(0.05)
-        recv_all(A)
+    # Send 20 broadcast messages to populate history buffer. The texts are
+    # encoded once; the commands and the expected history derive from them
+    texts = [f"Message_{i}".encode() for i in range(20)]
+    msgs = [b"say$ " + t for t in texts]
+    # Bind the send and sleep methods once rather than per message
+    _send, _sleep = A.send, time.sleep
+    for m in msgs:
+        _send(m)
+        _sleep(SEND_GAP)
+    recv_all(A, max_wait=0)
 
     print("Finished sending 20 messages.")
     print("Connecting second client to receive history...\n")
@@ -56,25 +52,26 @@ def main():
     history_packets = recv_all(B, max_wait=1.5)
     
     # Extract history-only packets
-    history_only = [h for h in history_packets if h.startswith("[History]")]
+    history_only = [h for h in history_packets if h.startswith(b"[History]")]
 
     print("\nHistory received:")
     for h in history_only:
-        print(" ", h)
+        print(" ", h.decode(errors="replace"))
 
     # Validate count
     if len(history_only) != 15:
         print("\nFAIL: Expected 15 history entries, received", len(history_only))
         return
 
-    expected = [f"[History] HistoryMaker: Message_{i}" for i in range(5, 20)]
+    # Server replies are ASCII, so compare bytes and skip decoding every packet
+    expected = [b"[History] HistoryMaker: " + t for t in texts[5:]]
 
     mismatched = False
     for e, g in zip(expected, history_only):
         if e != g:
             print("\nMismatch detected:")
-            print("Expected:", e)
-            print("Got:     ", g)
+            print("Expected:", e.decode())
+            print("Got:     ", g.decode(errors="replace"))
             mismatched = True
 
     if not mismatched:
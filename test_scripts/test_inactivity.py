@@ -1,55 +1,32 @@
-import socket
+import re
+import selectors
 import time
 
-SERVER_IP = "127.0.0.1"
-SERVER_PORT = 12000
+from test_util import banner, make_client, recv_all, send, wait_for_response
+from udp_batch import recv_batch
 
 MAX_WAIT_TIME = 45   # must exceed inactivity + ping timeout + monitor delay
 
-# Fn for printing section banners
-def banner(text):
-    print("\n" + "=" * 60)
-    print(text)
-    print("=" * 60)
-
-# Create and return a UDP client socket
-def make_client(label):
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    sock.bind(("", 0))
-    sock.settimeout(0.5)
-    return sock
-
-# Send a message to the server
-def send(sock, msg):
-    sock.sendto(msg.encode(), (SERVER_IP, SERVER_PORT))
-
-# Collect all packets that arrive within a short time window
-def recv_all(sock, label):
-    results = []
-    sock.setblocking(False)
-    while True:
-        try:
-            data, _ = sock.recvfrom(4096)
-            text = data.rstrip(b"\x00").decode(errors="replace").strip()
-            results.append(f"[{label}] {text}")
-        except:
-            break
-    sock.setblocking(True)
-    return results
+KEEPALIVE = b"say$ Still here"   # encoded once, sent on every keepalive
+
+# One scan per raw packet; lastindex says which event it was
+_PAT = re.compile(rb"(ping\$)|(disconnected)|(removed)", re.I)
+PING, DISCONNECTED, REMOVED = 1, 2, 3
 
 def main():
 
     banner("PE2 INACTIVITY MONITOR TEST")
 
     # Create two clients: one active, one idle
-    Active = make_client("Active")
-    Idle   = make_client("Idle")
+    Active = make_client()
+    Idle   = make_client()
 
     banner("CONNECTING CLIENTS")
 
     send(Active, "conn$ActiveClient")
     send(Idle,   "conn$IdleClient")
-    time.sleep(1)
+    wait_for_response(Active, 1)
+    wait_for_response(Idle, 1)
 
     for out in recv_all(Active, "Active"): print(out)
     for out in recv_all(Idle,   "Idle"):   print(out)
@@ -59,7 +36,10 @@ def main():
     # Active client sends periodic messages to stay active
     for i in range(3):
         print(f"\n[Active] sending keepalive message {i + 1}")
-        send(Active, "say$ Still here")
+        Active.send(KEEPALIVE)
+        # The spacing is the point: it keeps Active's last_active ahead of
+        # Idle's (the server tracks it in whole seconds), so the monitor
+        # picks Idle as the least-recently-active client
         time.sleep(1)
 
         for out in recv_all(Active, "Active"): print(out)
@@ -73,31 +53,39 @@ def main():
     idle_kicked = False
     removal_seen = False
 
-    start = time.time()
+    # Wake the moment either client gets a packet instead of polling every 0.5s
+    sel = selectors.DefaultSelector()
+    sel.register(Idle, selectors.EVENT_READ, "Idle")
+    sel.register(Active, selectors.EVENT_READ, "Active")
 
-    # Monitor both clients for server messages
-    while time.time() - start < MAX_WAIT_TIME:
+    start = time.monotonic()   # immune to wall-clock steps during the long wait
 
-        for msg in recv_all(Idle, "Idle"):
-            print(msg)
+    # Monitor both clients for server messages
+    while time.monotonic() - start < MAX_WAIT_TIME:
 
-            if "ping$" in msg:
-                idle_pinged = True
+        for key, _ in sel.select(timeout=0.5):
+            for raw in recv_batch(key.fileobj):
+                raw = raw.rstrip(b"\x00").strip()
+                print(f"[{key.data}] {raw.decode(errors='replace')}")
 
-            if "disconnected" in msg.lower():
-                idle_kicked = True
+                m = _PAT.search(raw)
+                if m is None:
+                    continue
 
-        for msg in recv_all(Active, "Active"):
-            print(msg)
+                if key.fileobj is Idle:
+                    if m.lastindex == PING:
+                        idle_pinged = True
+                    elif m.lastindex == DISCONNECTED:
+                        idle_kicked = True
 
-            if "disconnected" in msg.lower() or "removed" in msg.lower():
-                removal_seen = True
+                elif m.lastindex in (DISCONNECTED, REMOVED):
+                    removal_seen = True
 
         # Check if all conditions met
         if idle_pinged and idle_kicked and removal_seen:
             break
 
-        time.sleep(0.5)
+    sel.close()
 
     banner("RESULT ANALYSIS")
 
@@ -123,7 +111,7 @@ def main():
         print("server removal can take up to ~40 seconds.")
 
     send(Active, "disconn$")
-    time.sleep(0.5)
+    wait_for_response(Active, 0.5)
 
 
 if __name__ == "__main__":
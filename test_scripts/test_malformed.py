@@ -2,18 +2,12 @@ import socket
 import time
 import os
 
-SERVER_IP = "127.0.0.1"
-SERVER_PORT = 12000
-TIMEOUT = 0.5
+from test_util import SERVER_IP, SERVER_PORT, banner
 
-# Fn for printing section banners
-def banner(title):
-    print("\n" + "=" * 60)
-    print(title)
-    print("=" * 60)
+TIMEOUT = 0.5
 
 
-# Create and return a UDP client socket
+# Create and return a blocking UDP client socket with a reply timeout
 def make_client():
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     sock.bind(("", 0))
@@ -1,52 +1,44 @@
-import socket
+import re
+import selectors
 import time
+from concurrent.futures import ThreadPoolExecutor
 
-SERVER_IP = "127.0.0.1"
-SERVER_PORT = 12000
-
-# Fn for printing section banners
-def banner(text):
-    print("\n" + "=" * 60)
-    print(text)
-    print("=" * 60)
-
-# Create and return a UDP client socket
-def make_client(label):
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    sock.bind(("", 0))
-    sock.settimeout(0.3)
-    print(f"[{label}] Bound to {sock.getsockname()[1]}")
-    return sock
-
-
-# Send a message to the server
-def send(sock, msg):
-    sock.sendto(msg.encode(), (SERVER_IP, SERVER_PORT))
-
-# Collect all packets that arrive within a short time window
-def recv_all(sock, label):
-    sock.setblocking(False)
-    outputs = []
-    while True:
-        try:
-            data, _ = sock.recvfrom(4096)
-            text = data.rstrip(b"\x00").decode(errors="replace").strip()
-            outputs.append(f"[{label}] {text}")
-        except:
-            break
-    sock.setblocking(True)
-    return outputs
+from test_util import banner, make_client, recv_all, send
+
+# Either wording the server uses for a departed client, in one scan
+_LEFT = re.compile(r"has left|disconnected")
 
+# Wait on every registered client at once until each socket in `waits` has
+# received a packet containing its expected text or matching its compiled
+# pattern (or max_wait expires), then sweep up whatever else arrived.
+# Returns {sock: [messages]}.
+def gather(sel, waits, max_wait=1.0):
+    got = {key.fileobj: [] for key in sel.get_map().values()}
+    pending = dict(waits)
+    deadline = time.monotonic() + max_wait
 
-# Clear any pending packets
-def drain(sock):
-    sock.setblocking(False)
-    while True:
-        try:
-            sock.recvfrom(4096)
-        except:
+    while pending:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
             break
-    sock.setblocking(True)
+        for key, _ in sel.select(remaining):
+            outputs = recv_all(key.fileobj, key.data)
+            got[key.fileobj] += outputs
+            want = pending.get(key.fileobj)
+            if want is None:
+                continue
+            if isinstance(want, str):
+                hit = any(want in m for m in outputs)
+            else:
+                hit = any(want.search(m) for m in outputs)
+            if hit:
+                del pending[key.fileobj]
+
+    # One zero-timeout poll tells us which sockets still have packets queued,
+    # so idle clients cost nothing instead of an empty recv each
+    for key, _ in sel.select(0):
+        got[key.fileobj] += recv_all(key.fileobj, key.data)
+    return got
 
 
 # Print test result and return pass/fail
@@ -70,24 +62,29 @@ def main():
     B = make_client("Bob")
     C = make_client("Charlie")
 
-    banner("CONNECTING CLIENTS")
+    # One selector over all three clients instead of sleeping + polling each
+    sel = selectors.DefaultSelector()
+    sel.register(A, selectors.EVENT_READ, "Alice")
+    sel.register(B, selectors.EVENT_READ, "Bob")
+    sel.register(C, selectors.EVENT_READ, "Charlie")
 
-    send(A, "conn$ Alice")
-    send(B, "conn$ Bob")
-    send(C, "conn$ Charlie")
-    time.sleep(1)
+    banner("CONNECTING CLIENTS")
 
-    drain(A)
-    drain(B)
-    drain(C)
+    # Fire all three handshakes at once so the server handles them concurrently
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        futures = [pool.submit(send, sock, f"conn$ {name}")
+                   for sock, name in ((A, "Alice"), (B, "Bob"), (C, "Charlie"))]
+        for fut in futures:
+            fut.result()
+    gather(sel, {A: "connected", B: "connected", C: "connected"})
 
     banner("BROADCAST TEST")
 
     send(A, "say$ Hello everyone!")
-    time.sleep(0.5)
+    got = gather(sel, {B: "Hello everyone!", C: "Hello everyone!"})
 
-    bob = recv_all(B, "Bob")
-    charlie = recv_all(C, "Charlie")
+    bob = got[B]
+    charlie = got[C]
 
     all_ok &= expect("Broadcast Bob",
         any("Hello everyone!" in m for m in bob),
@@ -104,11 +101,10 @@ def main():
     banner("PRIVATE MESSAGE TEST (Bob → Charlie)")
 
     send(B, "sayto$ Charlie secret from Bob")
-    time.sleep(0.5)
+    got = gather(sel, {B: "Message delivered", C: "secret from Bob"})
 
-    alice = recv_all(A, "Alice")
-    bob = recv_all(B, "Bob")
-    charlie = recv_all(C, "Charlie")
+    alice = got[A]
+    charlie = got[C]
 
     all_ok &= expect("Private visible to Charlie",
         any("secret from Bob" in m for m in charlie),
@@ -125,12 +121,18 @@ def main():
     banner("MUTE TEST (Charlie mutes Alice)")
 
     send(C, "mute$ Alice")
-    time.sleep(0.3)
+    gather(sel, {C: "muted"})
 
+    # Bob's copy means the broadcast is under way. The connect order (and
+    # so the server's client list order) isn't fixed, so Charlie's copy may
+    # not be written yet; re-muting (a no-op) needs the clients write lock,
+    # so its reply only comes back once the broadcast loop has finished
     send(A, "say$ Charlie can't hear this")
-    time.sleep(0.5)
+    got = gather(sel, {B: "can't hear"})
+    charlie = got[C]
 
-    charlie = recv_all(C, "Charlie")
+    send(C, "mute$ Alice")
+    charlie += gather(sel, {C: "mute"})[C]
 
     all_ok &= expect("Mute",
         not any("can't hear" in m for m in charlie),
@@ -141,12 +143,12 @@ def main():
     banner("UNMUTE TEST")
 
     send(C, "unmute$ Alice")
-    time.sleep(0.3)
+    gather(sel, {C: "unmuted"})
 
     send(A, "say$ Now Charlie CAN hear this")
-    time.sleep(0.5)
+    got = gather(sel, {C: "CAN hear"})
 
-    charlie = recv_all(C, "Charlie")
+    charlie = got[C]
 
     all_ok &= expect("Unmute",
         any("CAN hear" in m for m in charlie),
@@ -157,9 +159,9 @@ def main():
     banner("RENAME TEST")
 
     send(A, "rename$ Alice123")
-    time.sleep(0.5)
+    got = gather(sel, {B: "Alice123"})
 
-    bob = recv_all(B, "Bob")
+    bob = got[B]
 
     all_ok &= expect("Rename propagation",
         any("Alice123" in m for m in bob),
@@ -170,13 +172,12 @@ def main():
     banner("DISCONNECT TEST")
 
     send(C, "disconn$")
-    time.sleep(0.5)
+    got = gather(sel, {B: _LEFT})
 
-    alice = recv_all(A, "Alice123")
-    bob = recv_all(B, "Bob")
+    bob = got[B]
 
     all_ok &= expect("Disconnect broadcast",
-        any("has left" in m or "disconnected" in m for m in bob),
+        any(_LEFT.search(m) for m in bob),
         "Disconnect announced",
         "Disconnect not announced"
     )
@@ -1,118 +1,216 @@
 #!/usr/bin/env python3
-import socket
+import asyncio
+import multiprocessing as mp
+import os
 import random
 import time
-import threading
 import string
 import sys
+import threading
 
-SERVER_IP = "127.0.0.1"
-SERVER_PORT = 12000
+from test_util import InFlight, check_socket_buffers, make_client, wait_readable, wait_reply
+from udp_batch import RecvBatch, SendBatch
 
 CLIENT_COUNT = 25
 TEST_DURATION = 10
 ACTIONS_PER_CLIENT = 200
-
-PRINT_LOCK = threading.Lock()
-
-# Thread-safe logging function
+SEND_BATCH = 16   # commands queued per sendmmsg() call
+PROCESSES = os.cpu_count() or 1   # clients are sharded across this many workers
+MAX_IN_FLIGHT = 32   # commands awaiting replies at once, across all workers
+REPLY_WAIT = 0.05    # longest a batch holds its slots waiting for replies
+
+# Encoded once up front; the action loop only concatenates bytes
+TARGETS = [f"User{k}".encode() for k in range(CLIENT_COUNT)]
+MUTE_MSGS = [b"mute$ " + t for t in TARGETS]
+UNMUTE_MSGS = [b"unmute$ " + t for t in TARGETS]
+SAYTO_PREFIXES = [b"sayto$ " + t + b" private_" for t in TARGETS]
+RENAME_PREFIX = b"rename$ "
+PRIVATE_SUFFIXES = [str(n).encode() for n in range(1000)]
+
+# Log lines from every worker process go through one multiprocessing queue
+# to a logger thread in the main process, so stdout writes never stall an
+# event loop; None tells the logger to finish. Set by init_shard()
+LOG_Q = None
+LOG_BATCH = 16
+
+# Queue a log line (non-blocking)
 def log(msg):
-    with PRINT_LOCK:
-        print(msg)
+    LOG_Q.put_nowait(msg)
 
-# Generate a random username
+# Logger thread: write whatever is queued, up to LOG_BATCH lines per write
+def drain_log():
+    while True:
+        lines = [LOG_Q.get()]
+        while len(lines) < LOG_BATCH and not LOG_Q.empty():
+            lines.append(LOG_Q.get_nowait())
+
+        done = lines[-1] is None
+        if done:
+            lines.pop()
+        sys.stdout.writelines(line + "\n" for line in lines)
+        sys.stdout.flush()
+        if done:
+            return
+
+# Maps every byte value onto a lowercase letter for rand_name()
+NAME_TABLE = bytes(string.ascii_lowercase.encode()[b % 26] for b in range(256))
+
+# Generate a random 6-letter username (one urandom pull, one C-level translate)
 def rand_name():
-    return ''.join(random.choice(string.ascii_lowercase) for _ in range(6))
-
-# Create and return a UDP client socket
-def make_client():
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    sock.bind(("", 0))
-    sock.settimeout(0.15)
-    return sock
+    return os.urandom(6).translate(NAME_TABLE).decode()
 
-# Send a message to the server
+# Send an already-encoded message to the server
 def send(sock, msg):
-    sock.sendto(msg.encode(), (SERVER_IP, SERVER_PORT))
+    sock.send(msg)
 
-# Collect all packets that arrive within a short time window
-def recv_all(sock):
-    messages = []
-    sock.setblocking(False)
+# Collect every packet already queued as raw bytes (one recvmmsg() per 64
+# packets); with `match`, only the packets containing it are copied out
+def recv_all(sock, rx, match=None):
+    return rx.recv(sock, match)
 
-    while True:
-        try:
-            data, _ = sock.recvfrom(4096)
-            text = data.rstrip(b"\x00").decode(errors="replace").strip()
-            messages.append(text)
-        except:
-            break
+# Clear any pending packets without copying them out
+def drain(sock, rx):
+    rx.discard(sock)
+
+# Decode one packet for printing
+def decode(data):
+    return data.rstrip(b"\x00").decode(errors="replace").strip()
+
+# Per-client state the action handlers read and update
+class ClientState:
+    __slots__ = ("name", "say_msg")
+
+    def __init__(self, name):
+        self.set_name(name)
+
+    def set_name(self, name):
+        self.name = name
+        self.say_msg = b"say$ Hello from " + name.encode()
+
+# Action handlers: each returns the encoded command to queue. Two-part
+# commands come back as (prefix, tail) and are gathered by sendmmsg()
+def do_say(ctx, target, suffix):
+    return ctx.say_msg
+
+def do_sayto(ctx, target, suffix):
+    return (SAYTO_PREFIXES[target], suffix)
+
+def do_rename(ctx, target, suffix):
+    ctx.set_name(rand_name())
+    return (RENAME_PREFIX, ctx.name.encode())
 
-    sock.setblocking(True)
-    return messages
+def do_mute(ctx, target, suffix):
+    return MUTE_MSGS[target]
 
-# Client thread function
-def client_thread(client_id):
+def do_unmute(ctx, target, suffix):
+    return UNMUTE_MSGS[target]
+
+# Drawn from directly, so picking an action is also dispatching it
+ACTION_TABLE = (do_say, do_sayto, do_rename, do_mute, do_unmute)
+
+# Client coroutine: one per simulated user, all on the same event loop.
+# start_delay staggers the joins so the clients don't connect in lockstep
+async def client(client_id, in_flight, start_delay=0.0):
+    await asyncio.sleep(start_delay)
     sock = make_client()
-    name = f"User{client_id}"
+    ctx = ClientState(f"User{client_id}")
+
+    # Per-client mmsghdr arrays: each client's batch may be mid-flush
+    rx = RecvBatch(64)
+    tx = SendBatch(SEND_BATCH)
 
     local_port = sock.getsockname()[1]
-    log(f"[{name}] Started on port {local_port}")
+    log(f"[{ctx.name}] Started on port {local_port}")
 
-    send(sock, f"conn$ {name}")
-    time.sleep(0.1)
-    recv_all(sock)   # ignore welcome + history
+    send(sock, b"conn$ " + ctx.name.encode())
+    await wait_reply(sock, rx, b"connected to the chat")   # ignore welcome + history
 
-    start = time.time()
+    # Integer deadline on the monotonic clock, read every 8th action
+    deadline = time.monotonic_ns() + TEST_DURATION * 1_000_000_000
     actions_done = 0
 
-    for _ in range(ACTIONS_PER_CLIENT):
-
-        if time.time() - start > TEST_DURATION:
+    # Every random draw for the run, generated up front in one pass each
+    actions = random.choices(ACTION_TABLE, k=ACTIONS_PER_CLIENT)
+    targets = [random.randrange(CLIENT_COUNT) for _ in range(ACTIONS_PER_CLIENT)]
+    suffixes = random.choices(PRIVATE_SUFFIXES, k=ACTIONS_PER_CLIENT)
+    pacing = [random.random() * 0.035 + 0.005 for _ in range(ACTIONS_PER_CLIENT)]
+
+    # Commands are queued and sent SEND_BATCH at a time, so each client
+    # sends bursts; the random delays of the queued actions are summed and
+    # slept off after each flush
+    batch = []
+    pause = 0.0
+
+    # Replies are searched in the receive buffers; only error lines are
+    # copied out and decoded
+    def report_errors():
+        for r in recv_all(sock, rx, match=b"ERR$"):
+            log(f"[{ctx.name}] ERROR: {decode(r)}")
+
+    # Each command holds one in_flight slot from send until its replies are
+    # read (at most REPLY_WAIT), so raising CLIENT_COUNT queues excess
+    # senders here instead of flooding the server; pacing sleeps outside it.
+    # A batch bigger than the cap goes out in cap-sized pieces
+    async def flush():
+        nonlocal pause
+        step = in_flight.limit
+        for start in range(0, len(batch), step):
+            piece = batch[start:start + step]
+            async with in_flight.hold(len(piece)):
+                tx.send(sock, piece)
+                await wait_readable(sock, REPLY_WAIT)
+                report_errors()
+        if not batch:
+            report_errors()
+        batch.clear()
+
+        await asyncio.sleep(pause)
+        pause = 0.0
+
+    for n, (action, target, suffix, delay) in enumerate(zip(actions, targets, suffixes, pacing)):
+
+        if n & 7 == 0 and time.monotonic_ns() > deadline:
             break
 
-        action = random.choice([
-            "say", "sayto", "rename", "mute", "unmute"
-        ])
+        # The server runs each datagram on its own thread, so commands in one
+        # burst can be applied in any order; rename$ gets a batch to itself
+        # so it never races the say$/sayto$ around it
+        is_rename = action is do_rename
+        if is_rename and batch:
+            await flush()
 
-        if action == "say":
-            msg = f"say$ Hello from {name}"
-            send(sock, msg)
+        batch.append(action(ctx, target, suffix))
+        actions_done += 1
 
-        elif action == "sayto":
-            target = f"User{random.randint(0, CLIENT_COUNT - 1)}"
-            msg = f"sayto$ {target} private_{random.randint(0, 999)}"
-            send(sock, msg)
+        # Pacing is per batch: the delay is slept once the batch is flushed
+        pause += delay
 
-        elif action == "rename":
-            newname = rand_name()
-            send(sock, f"rename$ {newname}")
-            name = newname
+        if is_rename or len(batch) == SEND_BATCH:
+            await flush()
 
-        elif action == "mute":
-            target = f"User{random.randint(0, CLIENT_COUNT - 1)}"
-            send(sock, f"mute$ {target}")
+    await flush()
 
-        elif action == "unmute":
-            target = f"User{random.randint(0, CLIENT_COUNT - 1)}"
-            send(sock, f"unmute$ {target}")
+    send(sock, b"disconn$")
+    await wait_reply(sock, rx, b"Bye!")
 
-        responses = recv_all(sock)
-        for r in responses:
-            if "ERR$" in r:
-                log(f"[{name}] ERROR: {r}")
+    sock.close()
+    log(f"[{ctx.name}] Finished after {actions_done} actions")
 
-        actions_done += 1
 
-        # random pacing avoids accidental synchronization
-        time.sleep(random.uniform(0.005, 0.04))
+# Start every client in `ids` at once (each delays its own join by 30ms * id);
+# `cap` is this shard's share of MAX_IN_FLIGHT
+async def run_clients(ids, cap):
+    in_flight = InFlight(cap)
+    await asyncio.gather(*(client(i, in_flight, start_delay=i * 0.03) for i in ids))
 
-    send(sock, "disconn$")
-    time.sleep(0.1)
-    recv_all(sock)
+# Point log() at the shared queue (main process and each worker)
+def init_shard(log_q):
+    global LOG_Q
+    LOG_Q = log_q
 
-    sock.close()
-    log(f"[{name}] Finished after {actions_done} actions")
+# Worker process: run one shard of clients on its own event loop
+def run_shard(ids, cap):
+    asyncio.run(run_clients(ids, cap))
 
 
 # Main test function
@@ -124,17 +222,35 @@ def main():
     print("Max actions per client:", ACTIONS_PER_CLIENT)
     print("=" * 70 + "\n")
 
-    threads = []
+    check_socket_buffers()
+
+    # Round-robin shards, so each worker's clients stay spread over the stagger.
+    # At most MAX_IN_FLIGHT workers, so each one gets at least one slot
+    procs = min(PROCESSES, CLIENT_COUNT, MAX_IN_FLIGHT)
+    shards = [list(range(k, CLIENT_COUNT, procs)) for k in range(procs)]
+
+    init_shard(mp.Queue())
+
     start = time.time()
-    
-    for i in range(CLIENT_COUNT):
-        th = threading.Thread(target=client_thread, args=(i,))
-        th.start()
-        threads.append(th)
-        time.sleep(0.03)   
-
-    for th in threads:
-        th.join()
+
+    # Split the in-flight cap so the driver-wide total stays MAX_IN_FLIGHT
+    cap = MAX_IN_FLIGHT // procs
+
+    # Workers are forked before the logger thread exists. If a shard fails,
+    # the logger is still stopped and leaving the with block terminates
+    # the pool, so the error surfaces instead of hanging the run
+    with mp.Pool(procs, initializer=init_shard, initargs=(LOG_Q,)) as pool:
+        logger = threading.Thread(target=drain_log, daemon=True)
+        logger.start()
+        try:
+            pool.starmap(run_shard, [(ids, cap) for ids in shards])
+            # close()+join() before the with's terminate() so workers flush
+            # their queued log lines
+            pool.close()
+            pool.join()
+        finally:
+            LOG_Q.put_nowait(None)
+            logger.join()
 
     elapsed = time.time() - start
 
@@ -1,119 +1,168 @@
-import socket
+import asyncio
 import random
 import time
-import threading
 
-SERVER_IP = "127.0.0.1"
-SERVER_PORT = 12000
+from test_util import InFlight, check_socket_buffers, make_client, wait_readable, wait_reply
+from udp_batch import RecvBatch, SendBatch
 
 CLIENT_COUNT = 25
 TEST_DURATION = 10
+SEND_BATCH = 16   # commands queued per sendmmsg() call
+ROLL = 256        # random draws generated per refill
+MAX_IN_FLIGHT = 32   # commands awaiting replies at once
+REPLY_WAIT = 0.05    # longest a batch holds its slots waiting for replies
 
-ACTIVE_USERS = {}
-LOCK = threading.Lock()
+ACTION_POOL = ("say", "sayto", "rename", "mute", "unmute")
 
-# Create and return a UDP client socket
-def make_client():
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    sock.bind(("", 0))
-    sock.settimeout(0.2)
-    return sock
+# Only touched from the event loop thread, so no lock is needed.
+# Names are stored encoded so commands are built by bytes concatenation
+ACTIVE_USERS = [None] * CLIENT_COUNT   # slot i = client i's current name
 
-# Send a message to the server
+# Send an already-encoded message to the server
 def send(sock, msg):
-    sock.sendto(msg.encode(), (SERVER_IP, SERVER_PORT))
+    sock.send(msg)
 
-# Clear any pending packets
-def drain(sock):
-    sock.setblocking(False)
-    while True:
-        try:
-            sock.recvfrom(4096)
-        except:
-            break
-    sock.setblocking(True)
+# Clear any pending packets (one recvmmsg() per 64 packets, nothing copied out)
+def drain(sock, rx):
+    rx.discard(sock)
 
 # Get a list of active users, excluding the given name
 def safe_users(exclude=None):
-    with LOCK:
-        users = list(ACTIVE_USERS.values())
-    if exclude and exclude in users:
-        users.remove(exclude)
-    return users
-
-# Client thread function
-def client_thread(i):
-    sock = make_client()
-    name = f"User{i}"
+    return [u for u in ACTIVE_USERS if u is not None and u != exclude]
 
-    with LOCK:
-        ACTIVE_USERS[i] = name
+# Client coroutine: one per simulated user, all on the same event loop.
+# start_delay staggers the joins so the clients don't connect in lockstep
+async def client(i, in_flight, start_delay=0.0):
+    await asyncio.sleep(start_delay)
+    sock = make_client()
+    name = f"User{i}".encode()
+
+    # Per-client mmsghdr arrays: each client's batch may be mid-flush
+    rx = RecvBatch(64)
+    tx = SendBatch(SEND_BATCH)
+
+    # Publish the name only once the server has registered it
+    send(sock, b"conn$" + name)
+    await wait_reply(sock, rx, b"connected to the chat")
+    ACTIVE_USERS[i] = name
+
+    # Integer deadline on the monotonic clock, read every 8th action
+    deadline = time.monotonic_ns() + TEST_DURATION * 1_000_000_000
+
+    # Rebuilt only when we rename
+    say_msg = b"say$Hello from " + name
+
+    # Commands are queued and sent SEND_BATCH at a time, so each client
+    # sends bursts; the random delays of the queued actions are summed and
+    # slept off after each flush
+    batch = []
+    pause = 0.0
+
+    # Each command holds one in_flight slot from send until its replies are
+    # read (at most REPLY_WAIT), so raising CLIENT_COUNT queues excess
+    # senders here instead of flooding the server; pacing sleeps outside it.
+    # A batch bigger than the cap goes out in cap-sized pieces
+    async def flush():
+        nonlocal pause
+        step = in_flight.limit
+        for start in range(0, len(batch), step):
+            piece = batch[start:start + step]
+            async with in_flight.hold(len(piece)):
+                tx.send(sock, piece)
+                await wait_readable(sock, REPLY_WAIT)
+                drain(sock, rx)
+        if not batch:
+            drain(sock, rx)
+        batch.clear()
+
+        await asyncio.sleep(pause)
+        pause = 0.0
+
+    # The run is time-bound, so random draws are generated ROLL at a time
+    # and refilled when used up (ROLL is a multiple of 8)
+    k = ROLL
 
-    send(sock, f"conn${name}")
-    drain(sock)
-    time.sleep(0.1)
+    while True:
 
-    start = time.time()
+        if k == ROLL:
+            actions = random.choices(ACTION_POOL, k=ROLL)
+            picks = [random.random() for _ in range(ROLL)]
+            pacing = [random.random() * 0.03 + 0.01 for _ in range(ROLL)]
+            k = 0
 
-    while time.time() - start < TEST_DURATION:
+        if k & 7 == 0 and time.monotonic_ns() > deadline:
+            break
 
-        with LOCK:
-            my_name = ACTIVE_USERS[i]
+        my_name = ACTIVE_USERS[i]
 
-        action = random.choice(["say", "sayto", "rename", "mute", "unmute"])
+        action = actions[k]
         targets = safe_users(exclude=my_name)
+        # Scale the precomputed draw to however many targets exist right now
+        target = targets[int(picks[k] * len(targets))] if targets else None
+        msg = None
 
         # broadcast
         if action == "say":
-            send(sock, f"say$Hello from {my_name}")
+            msg = say_msg
 
         # private
         elif action == "sayto" and targets:
-            target = random.choice(targets)
-            send(sock, f"sayto${target} hi")
+            msg = b"sayto$" + target + b" hi"
 
         # rename
         elif action == "rename":
-            newname = f"{my_name}_{random.randint(0,999)}"
-            send(sock, f"rename${newname}")
-            with LOCK:
-                ACTIVE_USERS[i] = newname
+            newname = my_name + b"_%d" % random.randint(0, 999)
+            # The server runs each datagram on its own thread, so rename$
+            # goes out in a batch of its own rather than racing the queued
+            # commands; other clients target us by name, so it also has to
+            # reach the server before the new name is published
+            if batch:
+                await flush()
+            batch.append(b"rename$" + newname)
+            await flush()
+            ACTIVE_USERS[i] = newname
+            say_msg = b"say$Hello from " + newname
 
         # mute
         elif action == "mute" and targets:
-            target = random.choice(targets)
-            send(sock, f"mute${target}")
+            msg = b"mute$" + target
 
         # unmute
         elif action == "unmute" and targets:
-            target = random.choice(targets)
-            send(sock, f"unmute${target}")
+            msg = b"unmute$" + target
 
-        time.sleep(random.uniform(0.01, 0.04))
-        drain(sock)
+        if msg is not None:
+            batch.append(msg)
+        # Pacing is per batch: the delay is slept once the batch is flushed
+        pause += pacing[k]
+        k += 1
 
-    send(sock, "disconn$")
-    drain(sock)
+        if len(batch) == SEND_BATCH:
+            await flush()
+
+    await flush()
+
+    send(sock, b"disconn$")
+    await wait_reply(sock, rx, b"Bye!")
     sock.close()
     print(f"[{i}] finished cleanly")
 
 
+# Start every client at once (each delays its own join by 20ms * id)
+async def run_clients():
+    in_flight = InFlight(MAX_IN_FLIGHT)
+    await asyncio.gather(*(client(i, in_flight, start_delay=i * 0.02) for i in range(CLIENT_COUNT)))
+
+
 # Main test function
 def main():
     print("\n" + "="*60)
     print("VALID LOAD STRESS TEST")
     print("="*60)
 
-    threads = []
-
-    for i in range(CLIENT_COUNT):
-        t = threading.Thread(target=client_thread, args=(i,))
-        t.start()
-        threads.append(t)
-        time.sleep(0.02)
+    check_socket_buffers()
 
-    for t in threads:
-        t.join()
+    asyncio.run(run_clients())
 
     print("\nTEST COMPLETE")
     print("Server should show:")
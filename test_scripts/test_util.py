@@ -0,0 +1,176 @@
+import asyncio
+import contextlib
+import select
+import selectors
+import socket
+import sys
+
+from udp_batch import discard_batch, recv_batch
+
+# Helpers shared by the functional test scripts (basics, history,
+# inactivity, multiclient, malformed) and the stress drivers
+
+SERVER_IP = "127.0.0.1"
+SERVER_PORT = 12000
+
+SOCK_BUF = 4 * 1024 * 1024   # requested SO_RCVBUF / SO_SNDBUF per client
+
+# Linux-only variants that ignore net.core.rmem_max/wmem_max (need CAP_NET_ADMIN);
+# not exported by the socket module
+_IS_LINUX = sys.platform.startswith("linux")
+SO_RCVBUFFORCE = getattr(socket, "SO_RCVBUFFORCE", 33 if _IS_LINUX else None)
+SO_SNDBUFFORCE = getattr(socket, "SO_SNDBUFFORCE", 32 if _IS_LINUX else None)
+
+# Reused for every reply instead of allocating a fresh bytes per recv
+_RECV_BUF = bytearray(8192)
+
+# Fn for printing section banners
+def banner(title):
+    print("\n" + "=" * 60)
+    print(title)
+    print("=" * 60)
+
+# Ask for large send/receive buffers so bursts aren't dropped by the kernel.
+# The FORCE options bypass the sysctl clamp when we have CAP_NET_ADMIN;
+# otherwise fall back to the plain options (clamped to rmem_max/wmem_max)
+def set_socket_buffers(sock, size=SOCK_BUF):
+    for force, plain in ((SO_RCVBUFFORCE, socket.SO_RCVBUF),
+                         (SO_SNDBUFFORCE, socket.SO_SNDBUF)):
+        if force is not None:
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, force, size)
+                continue
+            except OSError:
+                pass
+        sock.setsockopt(socket.SOL_SOCKET, plain, size)
+
+# Warn (once, from a driver's main()) if the kernel capped the buffers above
+def check_socket_buffers(size=SOCK_BUF):
+    probe = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    set_socket_buffers(probe, size)
+    rcv = probe.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+    snd = probe.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF)
+    probe.close()
+
+    # Linux reports back double the requested size (bookkeeping overhead)
+    if rcv < size or snd < size:
+        print(f"NOTE: socket buffers capped at rcv={rcv} snd={snd} bytes (wanted {size}).")
+        print("      Raise the limits to avoid drops under load (see README):")
+        print("      sudo sysctl -w net.core.rmem_max=12582912 net.core.wmem_max=12582912\n")
+
+# Create and return a non-blocking UDP client socket connected to the server
+def make_client(label=None):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    # Each client needs its own ephemeral port: the server identifies
+    # clients by source ip:port, so sharing one via SO_REUSEPORT would
+    # merge every client into a single user
+    sock.bind(("", 0))
+    set_socket_buffers(sock)   # 4MB each way so bursts aren't dropped
+    # Fix the server as the default peer so sends/receives skip the address
+    sock.connect((SERVER_IP, SERVER_PORT))
+    sock.setblocking(False)
+    if label:
+        print(f"[{label}] Bound to {sock.getsockname()[1]}")
+    return sock
+
+# Send a message to the server
+def send(sock, msg):
+    sock.send(msg.encode())
+
+# Block until sock has a packet queued (or max_wait expires); True if readable
+def wait_for_response(sock, max_wait):
+    with selectors.DefaultSelector() as sel:
+        sel.register(sock, selectors.EVENT_READ)
+        return bool(sel.select(max_wait))
+
+# Event-loop version of wait_for_response(): await until sock is readable
+# (or timeout expires) without blocking the loop; True if readable
+async def wait_readable(sock, timeout):
+    loop = asyncio.get_running_loop()
+    ready = loop.create_future()
+    loop.add_reader(sock, lambda: ready.done() or ready.set_result(None))
+    try:
+        await asyncio.wait((ready,), timeout=timeout)
+    finally:
+        loop.remove_reader(sock)
+    return ready.done()
+
+# Wait up to `timeout` for a reply containing `marker`, draining `rx`
+# (a udp_batch.RecvBatch) and discarding everything read on the way;
+# returns as soon as it arrives
+async def wait_reply(sock, rx, marker, timeout=0.2):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while True:
+        for data in rx.recv(sock):
+            if marker in data:
+                return True
+
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            return False
+        await wait_readable(sock, remaining)
+
+# Cap on commands awaiting replies across the clients of one event loop.
+# A batch of n commands takes n slots at once; the gate lets only one
+# client collect slots at a time, so partial holds can't deadlock
+class InFlight:
+    def __init__(self, limit):
+        self.limit = limit
+        self._slots = asyncio.BoundedSemaphore(limit)
+        self._gate = asyncio.Lock()
+
+    # Hold n slots (n <= limit) for the duration of the block
+    @contextlib.asynccontextmanager
+    async def hold(self, n):
+        async with self._gate:
+            for _ in range(n):
+                await self._slots.acquire()
+        try:
+            yield
+        finally:
+            for _ in range(n):
+                self._slots.release()
+
+# Collect every packet already queued, tagged with the client's label.
+# A connected socket reports an ICMP port-unreachable (no server listening)
+# as ConnectionRefusedError; treat it like an empty queue
+def recv_all(sock, label):
+    results = []
+    try:
+        for data in recv_batch(sock):
+            text = data.rstrip(b"\x00").decode(errors="replace").strip()
+            results.append(f"[{label}] {text}")
+    except ConnectionRefusedError:
+        pass
+    return results
+
+# Clear any queued UDP packets so each test only reads responses related to the current command
+def drain_socket(sock):
+    """Remove any queued packets so we read only new responses."""
+    try:
+        discard_batch(sock)
+    except ConnectionRefusedError:
+        pass
+
+# Send a command to the server and print the first reply (if any)
+def send_recv(sock, msg, timeout=1.0):
+    """Send a request and return the first response (if any)."""
+    # Per command: one recvmmsg() drain, send, one select(), one recv
+    drain_socket(sock)
+
+    print(f"→ Sending: {msg}")
+    reply = None
+    try:
+        sock.send(msg.encode())
+
+        # A single select() call; no selector setup/teardown per command
+        if select.select([sock], [], [], timeout)[0]:
+            nbytes = sock.recv_into(_RECV_BUF, 8192)
+            reply = _RECV_BUF[:nbytes].rstrip(b"\x00").decode(errors="replace").strip()
+    except ConnectionRefusedError:
+        # No server listening: the connected socket gets the ICMP error
+        pass
+
+    print("← Received:")
+    print("  ", reply if reply is not None else "<NO RESPONSE>")
@@ -0,0 +1,242 @@
+import ctypes
+import errno
+import os
+import socket
+
+# Batched UDP send/receive helpers for the test scripts.
+# Uses Linux recvmmsg()/sendmmsg() through ctypes so a whole burst of
+# datagrams moves through the kernel with one syscall instead of one
+# recvfrom()/sendto() per packet. Falls back to plain per-packet calls when
+# the batch calls are not available (non-Linux libc or ENOSYS).
+
+BATCH_SIZE = 32
+BUF_SIZE = 4096
+MAX_PARTS = 4     # iovecs per outgoing datagram (gathered by the kernel)
+
+MSG_DONTWAIT = getattr(socket, "MSG_DONTWAIT", 0x40)
+
+
+# struct iovec / struct msghdr / struct mmsghdr from <sys/socket.h>
+class iovec(ctypes.Structure):
+    _fields_ = [
+        ("iov_base", ctypes.c_void_p),
+        ("iov_len", ctypes.c_size_t),
+    ]
+
+
+class msghdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_name", ctypes.c_void_p),
+        ("msg_namelen", ctypes.c_uint32),
+        ("msg_iov", ctypes.POINTER(iovec)),
+        ("msg_iovlen", ctypes.c_size_t),
+        ("msg_control", ctypes.c_void_p),
+        ("msg_controllen", ctypes.c_size_t),
+        ("msg_flags", ctypes.c_int),
+    ]
+
+
+class mmsghdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_hdr", msghdr),
+        ("msg_len", ctypes.c_uint),
+    ]
+
+
+# Look up a libc function, or None if this platform doesn't provide it
+def _load_libc(name, argtypes):
+    try:
+        libc = ctypes.CDLL("libc.so.6", use_errno=True)
+        fn = getattr(libc, name)
+    except (OSError, AttributeError):
+        return None
+    fn.argtypes = argtypes
+    fn.restype = ctypes.c_int
+    return fn
+
+
+_recvmmsg = _load_libc("recvmmsg", [ctypes.c_int, ctypes.POINTER(mmsghdr),
+                                    ctypes.c_uint, ctypes.c_int, ctypes.c_void_p])
+_sendmmsg = _load_libc("sendmmsg", [ctypes.c_int, ctypes.POINTER(mmsghdr),
+                                    ctypes.c_uint, ctypes.c_int])
+
+
+class RecvBatch:
+    """Preallocated mmsghdr array + buffers, reused across recvmmsg() calls."""
+
+    def __init__(self, count=BATCH_SIZE, size=BUF_SIZE):
+        self.count = count
+        self.size = size
+        # One bytearray backs every buffer, so packets can be searched in
+        # place (bytearray.find) without copying them out first
+        self.pool = bytearray(size * count)
+        self.bufs = ((ctypes.c_char * size) * count).from_buffer(self.pool)
+        self.iovs = (iovec * count)()
+        self.msgs = (mmsghdr * count)()
+        self.addrs = [ctypes.addressof(buf) for buf in self.bufs]
+        self.scratch = bytearray(size)
+        self.scratch_view = memoryview(self.scratch)
+
+        for i in range(count):
+            self.iovs[i].iov_base = self.addrs[i]
+            self.iovs[i].iov_len = size
+            self.msgs[i].msg_hdr.msg_iov = ctypes.pointer(self.iovs[i])
+            self.msgs[i].msg_hdr.msg_iovlen = 1
+
+    # Return every datagram currently queued on sock (never blocks).
+    # With `match`, the whole queue is still drained but only datagrams
+    # containing it are copied out
+    def recv(self, sock, match=None):
+        packets = []
+        self._drain(sock, packets, match)
+        return packets
+
+    # Throw away every queued datagram without copying it out; returns the count
+    def discard(self, sock):
+        return self._drain(sock, None)
+
+    # Pull the queue empty, appending payloads to `out` unless it is None
+    def _drain(self, sock, out, match=None):
+        global _recvmmsg
+
+        if _recvmmsg is None:
+            return self._drain_loop(sock, out, match)
+
+        total = 0
+        fd = sock.fileno()
+        # Bind hot attributes to locals once rather than per packet
+        msgs, addrs, count, size = self.msgs, self.addrs, self.count, self.size
+        string_at, find = ctypes.string_at, self.pool.find
+        append = out.append if out is not None else None
+        while True:
+            n = _recvmmsg(fd, msgs, count, MSG_DONTWAIT, None)
+            if n < 0:
+                err = ctypes.get_errno()
+                if err == errno.ENOSYS:
+                    _recvmmsg = None
+                    return total + self._drain_loop(sock, out, match)
+                # Interrupted by a signal: retry, like socket.recvfrom() does
+                if err == errno.EINTR:
+                    continue
+                if err in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                # Anything else is a real failure, not an empty queue
+                raise OSError(err, os.strerror(err))
+
+            total += n
+            if append is not None:
+                for i in range(n):
+                    length = msgs[i].msg_len
+                    if match is None or find(match, i * size, i * size + length) >= 0:
+                        append(string_at(addrs[i], length))
+
+            # A short batch means the queue is empty
+            if n < count:
+                break
+
+        return total
+
+    # Fallback: one MSG_DONTWAIT recv_into() per packet, reusing one buffer.
+    # Only an empty queue ends the loop; EINTR is retried by Python itself
+    # (PEP 475) and any other error propagates
+    def _drain_loop(self, sock, out, match=None):
+        total = 0
+        recv_into, scratch, view, size = sock.recv_into, self.scratch, self.scratch_view, self.size
+        while True:
+            try:
+                nbytes = recv_into(scratch, size, MSG_DONTWAIT)
+            except BlockingIOError:
+                break
+            total += 1
+            if out is not None and (match is None or scratch.find(match, 0, nbytes) >= 0):
+                out.append(bytes(view[:nbytes]))
+        return total
+
+
+class SendBatch:
+    """Preallocated mmsghdr/iovec arrays for sendmmsg(), reused across calls."""
+
+    def __init__(self, count=BATCH_SIZE, parts=MAX_PARTS):
+        self.count = count
+        self.parts = parts
+        self.iovs = ((iovec * parts) * count)()
+        self.msgs = (mmsghdr * count)()
+
+        for i in range(count):
+            self.msgs[i].msg_hdr.msg_iov = ctypes.pointer(self.iovs[i][0])
+            self.msgs[i].msg_hdr.msg_iovlen = 1
+
+    # Send each payload as its own datagram on a connected socket, `count`
+    # datagrams per syscall. A payload is either bytes or a tuple of up to
+    # `parts` bytes chunks, which the kernel gathers into one datagram
+    # (no concatenation here)
+    def send(self, sock, payloads):
+        global _sendmmsg
+
+        if _sendmmsg is None:
+            return self._send_loop(sock, payloads)
+
+        fd = sock.fileno()
+
+        # Bind hot attributes to locals once rather than per packet
+        iovs, msgs, count, parts = self.iovs, self.msgs, self.count, self.parts
+        cast, c_char_p, c_void_p = ctypes.cast, ctypes.c_char_p, ctypes.c_void_p
+
+        for start in range(0, len(payloads), count):
+            chunk = payloads[start:start + count]
+
+            # Point the iovecs straight at the bytes objects (no copy);
+            # `payloads` keeps them alive for the duration of the call
+            for i, data in enumerate(chunk):
+                row = iovs[i]
+                hdr = msgs[i].msg_hdr
+                if type(data) is bytes:
+                    iov = row[0]
+                    iov.iov_base = cast(c_char_p(data), c_void_p)
+                    iov.iov_len = len(data)
+                    hdr.msg_iovlen = 1
+                else:
+                    if len(data) > parts:
+                        raise ValueError(f"datagram has {len(data)} parts, max is {parts}")
+                    for j, part in enumerate(data):
+                        iov = row[j]
+                        iov.iov_base = cast(c_char_p(part), c_void_p)
+                        iov.iov_len = len(part)
+                    hdr.msg_iovlen = len(data)
+
+            sent = 0
+            while sent < len(chunk):
+                first = cast(ctypes.byref(msgs[sent]), ctypes.POINTER(mmsghdr))
+                n = _sendmmsg(fd, first, len(chunk) - sent, 0)
+                if n < 0:
+                    err = ctypes.get_errno()
+                    if err == errno.ENOSYS:
+                        _sendmmsg = None
+                        return self._send_loop(sock, payloads[start + sent:])
+                    if err == errno.EINTR:
+                        continue
+                    raise OSError(err, os.strerror(err))
+                sent += n
+
+    # Fallback: one send() per datagram, sendmsg() for chunked ones
+    def _send_loop(self, sock, payloads):
+        send, sendmsg = sock.send, sock.sendmsg
+        for data in payloads:
+            if type(data) is bytes:
+                send(data)
+            else:
+                sendmsg(data)
+
+
+# Shared instance for the single-threaded test scripts
+_default_batch = RecvBatch()
+
+
+# Drain all queued datagrams from sock with as few syscalls as possible
+def recv_batch(sock):
+    return _default_batch.recv(sock)
+
+
+# Drain and drop all queued datagrams from sock; returns how many there were
+def discard_batch(sock):
+    return _default_batch.discard(sock)